@@ -1,57 +1,348 @@
 import asyncio
-import aiohttp
+import hashlib
+import importlib.util
+import io
+import os
+import pathlib
 import re
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+import httpx
+import pytz
+
+# optional C-backed HTML parser; without it we fall back to the regex/find path
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# optional Hyperscan prefilter: one SIMD scan of the raw page locates the listing
+# sentence so the Python strict regex only runs on a few hundred bytes
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+# optional RE2 backend for the strict pattern (linear time, no backtracking)
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# optional libuv-based event loop for the __main__ entry point
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 URL = 'https://www.mexc.co/vi-VN/announcements/17827791531874'
 
-async def main():
-    async with aiohttp.ClientSession(headers={'User-Agent':'Mozilla/5.0'}) as session:
-        try:
-            async with session.get(URL, timeout=15) as r:
-                text = await r.text()
-        except Exception as e:
-            print('Error fetching:', e)
-            return
+VN_TZ = pytz.timezone("Asia/Ho_Chi_Minh")
 
-    # print meta og:title
-    m = re.search(r'<meta[^>]+property=["\']og:title["\'][^>]+content=["\']([^"\']+)["\']', text)
-    if m:
-        print('OG Title:', m.group(1))
+_OG_TITLE_RE = re.compile(rb'<meta[^>]+property=["\']og:title["\'][^>]+content=["\']([^"\']+)["\']', re.IGNORECASE)
+_STRICT_RE = re.compile(r"Đầu tiên trên thị trường\s*:\s*MEXC niêm yết\s+(.+?)\s*\(([A-Z0-9]{2,10})\)\s*USDT-M Futures\s*vào\s*(\d{1,2}:\d{2}\s*\d{1,2}/\d{1,1}/\d{4})", re.IGNORECASE)
+if re2 is not None:
+    # RE2's \s is ASCII-only; widen it so &nbsp; etc. still match like Python's \s
+    _STRICT_RE = re2.compile('(?i)' + _STRICT_RE.pattern.replace(r'\s', r'[\s\v\p{Z}]'))
+
+# bounded-gap version of _STRICT_RE for the raw-bytes path: reports the leftmost
+# start of "Đầu tiên trên thị trường ... (TICKER) ... USDT-M Futures"; _STRICT_RE then
+# runs on [start, end + _HS_SPAN_TAIL) only, the tail covering "vào HH:MM D/M/YYYY"
+_HS_SPAN_TAIL = 64
+_HS_DB = None
+if hyperscan is not None:
+    _HS_DB = hyperscan.Database()
+    _HS_DB.compile(
+        expressions=['Đầu tiên trên thị trường.{0,200}\\([A-Z0-9]{2,10}\\).{0,40}USDT-M Futures'.encode('utf-8')],
+        ids=[0],
+        elements=1,
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_DOTALL | hyperscan.HS_FLAG_SOM_LEFTMOST],
+    )
+
+# the announcement body is always within the first 64 KB of the rendered HTML;
+# capping the strict search keeps its lazy `.+?` from walking a whole page
+_STRICT_SCAN_LIMIT = 64 * 1024
+
+# keywords for the excerpt dump, paired with their (ASCII-)lowercased byte form;
+# _KW_RE finds all of them in a single pass over the page
+_KEYWORDS = ['Đầu tiên trên thị trường','MEXC niêm yết','USDT-M Futures','Meme+']
+_KEYWORD_NEEDLES = [(kw, kw.encode('utf-8').lower()) for kw in _KEYWORDS]
+_KW_RE = re.compile(b'|'.join(re.escape(kw.encode('utf-8')) for kw in _KEYWORDS), re.IGNORECASE)
+
+_CHUNK_SIZE = 8192
+# literal, case-insensitive finders: scan the original buffer without a lowercased copy
+_ARTICLE_START_RE = re.compile(rb'<article', re.IGNORECASE)
+_ARTICLE_END_RE = re.compile(rb'</article>', re.IGNORECASE)
+_RELATED_RE = re.compile(rb'relatedarticles', re.IGNORECASE)
+
+# on-disk copy of fetched pages so repeated debug runs skip the network;
+# set MEXC_DEBUG_NO_CACHE=1 to force a fresh download
+_CACHE_DIR = pathlib.Path.home() / '.cache' / 'mexc-debug'
+_CACHE_TTL = float(os.getenv('MEXC_DEBUG_CACHE_TTL', '600'))
+
+# only advertise br when a brotli decoder is importable (optional: pip install Brotli),
+# otherwise httpx can't decode it
+try:
+    import brotli  # noqa: F401
+    _ACCEPT_ENCODING = 'br, gzip, deflate'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        _ACCEPT_ENCODING = 'br, gzip, deflate'
+    except ImportError:
+        _ACCEPT_ENCODING = 'gzip, deflate'
+
+# HTTP/2 lets repeated fetches to www.mexc.co multiplex over one TLS connection;
+# httpx needs the `h2` package for it (pip install 'httpx[http2]'), else HTTP/1.1 keep-alive
+_HTTP2 = importlib.util.find_spec('h2') is not None
+
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_HTTP2,
+        headers={'User-Agent':'Mozilla/5.0', 'Accept-Encoding':_ACCEPT_ENCODING},
+        timeout=15.0,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=75),
+    )
+
+
+def _get_client() -> httpx.AsyncClient:
+    # one pooled client for the __main__ run so repeated fetches reuse DNS + keep-alive connections
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = _new_client()
+    return _CLIENT
+
+
+async def _close_client():
+    global _CLIENT
+    if _CLIENT is not None and not _CLIENT.is_closed:
+        await _CLIENT.aclose()
+    _CLIENT = None
+
+
+def _cache_path(url: str) -> pathlib.Path:
+    return _CACHE_DIR / (hashlib.sha1(url.encode()).hexdigest() + '.html')
+
+
+def _read_cache(url: str) -> Optional[bytes]:
+    if os.getenv('MEXC_DEBUG_NO_CACHE'):
+        return None
+    p = _cache_path(url)
+    try:
+        if time.time() - p.stat().st_mtime < _CACHE_TTL:
+            return p.read_bytes()
+    except OSError:
+        pass
+    return None
+
+
+def _write_cache(url: str, raw: bytes, out: Optional[io.StringIO] = None):
+    # cache problems are only reported into the debug report; library callers stay silent
+    p = _cache_path(url)
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(raw)
+    except OSError as e:
+        if out is not None:
+            print('Cache write failed:', e, file=out)
+
+
+def _article_span(raw: bytes) -> Optional[tuple[int, int]]:
+    # two literal searches instead of a lazy <article>...</article> regex
+    m_start = _ARTICLE_START_RE.search(raw)
+    if not m_start:
+        return None
+    m_end = _ARTICLE_END_RE.search(raw, m_start.end())
+    if not m_end:
+        return None
+    return m_start.start(), m_end.end()
+
+
+def _extract_main(raw: bytes) -> tuple[Optional[str], str]:
+    # returns (og:title, main_text) where main_text is the article part the strict pattern runs on
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(raw)
+        og_node = tree.css_first('meta[property="og:title"]')
+        og_title = og_node.attributes.get('content') if og_node else None
+        node = tree.css_first('article') or tree.body
+        main_text = node.text() if node else ''
+        return og_title, main_text[:_STRICT_SCAN_LIMIT]
+
+    m = _OG_TITLE_RE.search(raw)
+    og_title = m.group(1).decode('utf-8', 'replace') if m else None
+
+    # Isolate main_text similarly to bot logic; only offsets are tracked here
+    start, end = 0, len(raw)
+    span = _article_span(raw)
+    if span:
+        start, end = span
     else:
-        print('No OG title')
+        m_rel = _RELATED_RE.search(raw)
+        if m_rel:
+            end = m_rel.start()
+    end = min(end, start + _STRICT_SCAN_LIMIT)
+    if _HS_DB is not None:
+        span = _listing_span(raw, start, end)
+        if span is None:
+            return og_title, ''
+        start, end = span
+    # decode straight from a memoryview window - no intermediate bytes slice
+    return og_title, str(memoryview(raw)[start:end], 'utf-8', 'replace')
+
+
+def _listing_span(raw: bytes, start: int, end: int) -> Optional[tuple[int, int]]:
+    # first Hyperscan hit inside [start, end), widened by _HS_SPAN_TAIL; the raw
+    # page is scanned as-is (no slice copy) and out-of-window hits are ignored
+    hits = []
+
+    def on_match(id_, frm, to, flags, ctx):
+        if frm >= start and to <= end:
+            hits.append((frm, to))
+
+    _HS_DB.scan(raw, match_event_handler=on_match)
+    if not hits:
+        return None
+    frm, to = min(hits)
+    return frm, min(end, to + _HS_SPAN_TAIL)
+
+
+async def _read_until_article(r: httpx.Response) -> bytes:
+    # Stream the body and stop as soon as a complete <article> block has arrived;
+    # we do not wait for the related-articles boilerplate after it. Leaving the
+    # `async with` early closes the response without draining it.
+    buf = bytearray()
+    async for chunk in r.aiter_bytes(_CHUNK_SIZE):
+        buf.extend(chunk)
+        # look only at the freshly received tail (plus overlap for a split tag)
+        tail_start = max(0, len(buf) - len(chunk) - len(b'</article>'))
+        if _ARTICLE_END_RE.search(buf, tail_start) and _article_span(buf):
+            break
+    return bytes(buf)
+
+
+async def _fetch_page(client: httpx.AsyncClient, url: str, out: Optional[io.StringIO] = None,
+                      use_cache: bool = False) -> bytes:
+    # the disk cache is a debug-run convenience only (_dump opts in); library
+    # callers such as fetch_many always hit the network
+    if use_cache:
+        raw = _read_cache(url)
+        if raw is not None:
+            if out is not None:
+                print('Using cached page:', _cache_path(url), file=out)
+            return raw
+    async with client.stream('GET', url) as r:
+        # never cache (or parse) a 403/429/5xx challenge page
+        r.raise_for_status()
+        raw = await _read_until_article(r)
+    if use_cache:
+        _write_cache(url, raw, out)
+    return raw
+
+
+def _parse_listing_time(t: str) -> Optional[datetime]:
+    # "HH:MM D/M/YYYY" as captured by _STRICT_RE; split by hand instead of strptime
+    try:
+        hh, rest = t.split(':', 1)
+        mm, date_part = rest[:2], rest[2:].strip()
+        d, mo, y = date_part.split('/')
+        return VN_TZ.localize(datetime(int(y), int(mo), int(d), int(hh), int(mm)))
+    except ValueError:
+        return None
 
-    # Isolate main_text similarly to bot logic
-    main_text = text
-    m_article = re.search(r"(<article[\s\S]*?</article>)", text, re.IGNORECASE)
-    if m_article:
-        main_text = m_article.group(1)
+
+def parse_article(raw: bytes) -> dict:
+    og_title, main_text = _extract_main(raw)
+    m = _STRICT_RE.search(main_text)
+    return {
+        'og_title': og_title,
+        'name': m.group(1) if m else None,
+        'ticker': m.group(2) if m else None,
+        'time': m.group(3) if m else None,
+        'listed_at': _parse_listing_time(m.group(3)) if m else None,
+    }
+
+
+async def fetch_article(url: str, client: httpx.AsyncClient, sem: asyncio.Semaphore) -> dict:
+    async with sem:
+        raw = await _fetch_page(client, url)
+    info = parse_article(raw)
+    info['url'] = url
+    return info
+
+
+async def fetch_many(urls: list[str], concurrency: int = 10) -> list:
+    # fetch concurrently, but never more than `concurrency` requests in flight;
+    # failed URLs come back as exception objects in their slot. The client is scoped
+    # to this call: its pooled connections belong to the running event loop.
+    sem = asyncio.BoundedSemaphore(concurrency)
+    async with _new_client() as client:
+        return await asyncio.gather(*(fetch_article(u, client, sem) for u in urls), return_exceptions=True)
+
+
+async def _dump(out: io.StringIO):
+    try:
+        raw = await _fetch_page(_get_client(), URL, out, use_cache=True)
+    except Exception as e:
+        print('Error fetching:', e, file=out)
+        return
+
+    info = parse_article(raw)
+
+    # print meta og:title
+    if info['og_title']:
+        print('OG Title:', info['og_title'], file=out)
     else:
-        idx = text.lower().find('relatedarticles')
-        if idx != -1:
-            main_text = text[:idx]
+        print('No OG title', file=out)
 
     # Search for strict pattern inside main_text
-    strict_pattern = re.compile(r"Đầu tiên trên thị trường\s*:\s*MEXC niêm yết\s+(.+?)\s*\(([A-Z0-9]{2,10})\)\s*USDT-M Futures\s*vào\s*(\d{1,2}:\d{2}\s*\d{1,2}/\d{1,1}/\d{4})", re.IGNORECASE)
-    m2 = strict_pattern.search(main_text)
-    if m2:
-        print('STRICT MATCH FOUND:')
-        print(' name=', m2.group(1))
-        print(' ticker=', m2.group(2))
-        print(' time=', m2.group(3))
+    if info['ticker']:
+        print('STRICT MATCH FOUND:', file=out)
+        print(' name=', info['name'], file=out)
+        print(' ticker=', info['ticker'], file=out)
+        print(' time=', info['time'], file=out)
+        print(' listed_at=', info['listed_at'], file=out)
     else:
-        print('No strict match in full page')
+        print('No strict match in full page', file=out)
 
-    # find first 400 chars around occurrences of 'Đầu tiên trên thị trường' or 'MEXC niêm yết'
-    keywords = ['Đầu tiên trên thị trường','MEXC niêm yết','USDT-M Futures','Meme+']
-    for kw in keywords:
-        idx = text.lower().find(kw.lower())
+    # find first 400 bytes around occurrences of 'Đầu tiên trên thị trường' or 'MEXC niêm yết'
+    seen: dict[bytes, int] = {}
+    for m_kw in _KW_RE.finditer(raw):
+        seen.setdefault(m_kw.group(0).lower(), m_kw.start())
+        if len(seen) == len(_KEYWORD_NEEDLES):
+            break
+    for kw, kw_l in _KEYWORD_NEEDLES:
+        idx = seen.get(kw_l, -1)
         if idx!=-1:
             start = max(0, idx-200)
-            end = min(len(text), idx+200)
-            print('\n--- EXCERPT FOR:', kw, '---')
-            print(text[start:end])
+            end = min(len(raw), idx+200)
+            print('\n--- EXCERPT FOR:', kw, '---', file=out)
+            print(raw[start:end].decode('utf-8', 'replace'), file=out)
         else:
-            print(f'\nNo occurrence of {kw}')
+            print(f'\nNo occurrence of {kw}', file=out)
+
+async def main():
+    # collect the whole report and emit it with a single write
+    out = io.StringIO()
+    try:
+        await _dump(out)
+    finally:
+        sys.stdout.write(out.getvalue())
+        sys.stdout.flush()
+
+async def _run():
+    try:
+        await main()
+    finally:
+        await _close_client()
 
 if __name__=='__main__':
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop is not None:
+        uvloop.run(_run())
+    else:
+        asyncio.run(_run())
\ No newline at end of file
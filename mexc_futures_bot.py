@@ -1,11 +1,16 @@
 import os
 import sys
 import asyncio
-import json
+import collections
+import html
 import pickle
+import tempfile
+import threading
+import time
 from datetime import datetime, timedelta
 
 import aiohttp
+import orjson
 import websockets
 import pytz
 from dotenv import load_dotenv
@@ -17,6 +22,7 @@ from telegram.ext import (
     ContextTypes,
 )
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter
 
 # ================== LOAD ENV ==================
 load_dotenv()
@@ -24,6 +30,19 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHANNEL_ID = os.getenv("CHANNEL_ID")  # "-1001234567890" hoặc "@channel_name"
 ADMIN_IDS = set(map(int, os.getenv("ADMIN_IDS", "").split(","))) if os.getenv("ADMIN_IDS") else set()
+CHANNEL_LINK = os.getenv("CHANNEL_LINK")  # link mời channel, hiện trong /start
+# link join hiện trong /start: CHANNEL_LINK, hoặc t.me/<name> nếu CHANNEL_ID là "@name"
+if not CHANNEL_LINK and CHANNEL_ID and CHANNEL_ID.startswith("@"):
+    CHANNEL_LINK = f"https://t.me/{CHANNEL_ID[1:]}"
+# Bật (=1) + có CHANNEL_ID và link join: subscriber dùng bộ lọc giống channel (mode 1,
+# không mute) đọc alert trong channel, bot chỉ nhắn riêng cho ai có bộ lọc riêng.
+# Mặc định tắt để bản cũ nâng cấp lên không tự dưng ngừng nhắn riêng cho subscriber.
+CHANNEL_DEDUP_DM = os.getenv("CHANNEL_DEDUP_DM", "0") == "1"
+
+# Webhook (optional): có PUBLIC_URL thì nhận update qua webhook, không thì long-polling
+PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")  # "https://my-bot.up.railway.app"
+PORT = int(os.getenv("PORT", "8080"))
+WH_SECRET = os.getenv("WH_SECRET") or None  # secret_token Telegram gửi kèm mỗi request
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN chưa được set trong .env")
@@ -31,6 +50,17 @@ if not BOT_TOKEN:
 # ================== CONFIG MEXC ==================
 FUTURES_BASE = "https://contract.mexc.co"
 WEBSOCKET_URL = "wss://contract.mexc.co/edge"  # endpoint futures ticker
+WS_MAX_SIZE = 2 ** 23         # frame tối đa 8 MiB
+WS_READ_LIMIT = 2 ** 20       # buffer đọc 1 MiB
+WS_WRITE_LIMIT = 2 ** 20      # buffer ghi 1 MiB (subscribe hàng trăm coin)
+WS_MAX_QUEUE = 256            # số frame websockets giữ sẵn chưa đọc
+TICK_QUEUE_SIZE = 8192        # queue frame ticker/kline chờ xử lý
+TICK_WORKERS = 4              # số worker chạy process_ticker/process_kline
+WS_PING_PREFIX = '{"ping":'
+WS_SHARDS = 3                 # số kết nối WebSocket song song, chia symbol (ticker + kline) theo hash
+WS_SHARD_STAGGER = 1.0        # giây lệch giữa lần connect đầu của các shard (không sub dồn cùng lúc)
+WS_SUB_BATCH = 50             # số frame subscribe gửi pipeline mỗi đợt
+WS_PONG_PREFIX = '{"pong":'
 
 # Ngưỡng để báo động (%)
 PUMP_THRESHOLD = 3.0      # Tăng >= 3%
@@ -46,19 +76,52 @@ OHLC_COOLDOWN_SECONDS = 30        # Cooldown giữa các alert OHLC cho cùng 1
 # Volume tối thiểu để tránh coin ít thanh khoản
 MIN_VOL_THRESHOLD = 100000
 
+# ================== TELEGRAM SEND LIMIT ==================
+SEND_GLOBAL_RATE = 30        # Telegram cho tối đa ~30 msg/s toàn bot
+SEND_PER_CHAT_INTERVAL = 1.0 # tối đa 1 msg/s cho mỗi chat
+SEND_CHANNEL_INTERVAL = 3.0  # group/channel: Telegram chỉ cho ~20 msg/phút
+SEND_MAX_AGE = 60.0          # alert chờ gửi quá lâu (giây) thì bỏ, tránh báo trễ
+SEND_WORKERS = 4             # số worker gửi song song
+SEND_QUEUE_MAXSIZE = 10000
+
 # ================== GLOBAL STATE ==================
 SUBSCRIBERS: set[int] = set()          # chat_id nhận alert private
 ALERT_MODE: dict[int, int] = {}        # {chat_id: 1|2|3}
 MUTED_COINS: dict[int, set[str]] = {}  # {chat_id: {symbol,...}}
 
+# Index dựng sẵn từ 3 dict trên (rebuild_sub_index) để vòng gửi alert không phải lọc từng chat
+ELIGIBLE_SUBS_BY_MODE: dict[int, set[int]] = {1: set(), 2: set(), 3: set()}  # chat cần DM theo mode
+MUTED_SYMBOLS_INDEX: dict[str, set[int]] = {}  # {symbol: {chat_id,...}} đã mute symbol đó
+
 KNOWN_SYMBOLS: set[str] = set()        # danh sách symbol đã biết (USDT futures)
-ALL_SYMBOLS: list[str] = []            # cache tất cả symbol
+ALL_SYMBOLS: set[str] = set()          # cache tất cả symbol
+
+
+class SymbolState:
+    """State giá realtime của 1 symbol (thời gian đều là time.monotonic())."""
+
+    __slots__ = (
+        "last_price",        # giá gần nhất
+        "last_time",         # thời điểm nhận giá gần nhất
+        "base_price",        # giá gốc để tính % biến động (None = chưa có)
+        "max_pct",           # % biến động lớn nhất kể từ lần reset base (None = chưa có)
+        "max_time",
+        "last_alert",        # thời điểm alert gần nhất (None = chưa alert)
+        "last_significant",  # thời điểm max_pct tăng gần nhất
+    )
+
+    def __init__(self):
+        self.last_price = 0.0
+        self.last_time = 0.0
+        self.base_price = None
+        self.max_pct = None
+        self.max_time = 0.0
+        self.last_alert = None
+        self.last_significant = None
+
+
+SYMBOL_STATE: dict[str, SymbolState] = {}  # {symbol: SymbolState}
 
-LAST_PRICES: dict[str, dict] = {}      # {symbol: {"price": float, "time": datetime}}
-BASE_PRICES: dict[str, float] = {}     # {symbol: base_price}
-ALERTED_SYMBOLS: dict[str, datetime] = {}  # {symbol: last_alert_time}
-MAX_CHANGES: dict[str, dict] = {}      # {symbol: {"max_pct": float, "time": datetime}}
-LAST_SIGNIFICANT_CHANGE: dict[str, datetime] = {}
 
 # ================== CANDLE CLOSE TRACKING ==================
 PUMP_DUMP_START_TIME: dict[str, datetime] = {}  # {symbol: datetime khi pump/dump bắt đầu}
@@ -67,28 +130,108 @@ CANDLE_INTERVAL_SECONDS = 60  # theo dõi candle 1 phút (60 giây)
 
 # ================== OHLC DATA TRACKING ==================
 OHLC_DATA: dict[str, dict] = {}                 # {symbol: {open, high, low, close, vol, amount, time}}
-OHLC_LAST_ALERT: dict[str, datetime] = {}       # {symbol: last_alert_time} - cooldown cho OHLC
+OHLC_LAST_ALERT: dict[str, float] = {}          # {symbol: last_alert_time (monotonic)} - cooldown cho OHLC
 
 DATA_FILE = "bot_data.pkl"
+SAVE_DEBOUNCE_SECONDS = 2.0
+SAVE_DIRTY = asyncio.Event()  # set khi state cần lưu xuống DATA_FILE
+SAVE_LOCK = threading.Lock()  # save_worker (thread) và save_data lúc shutdown không ghi chồng nhau
+
+# Queue để thông báo WebSocket subscribe thêm coin mới (dynamic) - 1 queue / shard
+WS_SUB_QUEUES: list[asyncio.Queue] = []
+
+# Queue frame ticker/kline: WS recv chỉ decode + put, TICK_WORKERS worker xử lý
+TICK_QUEUE: "FastQueue | None" = None
+
+# WebSocket + tick worker chạy trên thread/event loop riêng (ws_thread);
+# MAIN_LOOP là loop của Telegram, nhận alert qua call_soon_threadsafe
+MAIN_LOOP: asyncio.AbstractEventLoop | None = None
+WS_LOOP: asyncio.AbstractEventLoop | None = None
+WS_THREAD_ID: int | None = None
 
-# Queue để thông báo WebSocket subscribe thêm coin mới (dynamic)
-WS_SUB_QUEUE: asyncio.Queue | None = None
+# Queue gửi Telegram: (chat_id, text, slot, enqueued_at) - WS loop chỉ put_nowait, worker lo gửi + rate limit
+# slot = None: item mới; slot: chỗ per-chat đã giữ (gửi lúc slot + CHAT_DELAY), được đưa lại đúng giờ
+# enqueued_at (time.monotonic) để bỏ alert quá SEND_MAX_AGE
+SEND_QUEUE: asyncio.Queue | None = None
+
+# 1 aiohttp session dùng chung cho cả app (giữ connection pool / keep-alive)
+HTTP_SESSION: aiohttp.ClientSession | None = None
+
+# Cache frame subscribe đã encode sẵn: {symbol: (sub_ticker, sub_kline)}
+SUB_FRAME_CACHE: dict[str, tuple[str, str]] = {}
 
 
 # ================== PERSISTENT DATA ==================
-def save_data() -> None:
-    data = {
-        "subscribers": SUBSCRIBERS,
-        "alert_mode": ALERT_MODE,
-        "muted_coins": MUTED_COINS,
-        "known_symbols": KNOWN_SYMBOLS,
+def _snapshot_data() -> dict:
+    """Copy state trên event loop để thread ghi file không thấy dict/set bị sửa giữa chừng."""
+    return {
+        "subscribers": set(SUBSCRIBERS),
+        "alert_mode": dict(ALERT_MODE),
+        "muted_coins": {k: set(v) for k, v in MUTED_COINS.items()},
+        "known_symbols": set(KNOWN_SYMBOLS),
     }
+
+
+def _write_data(data: dict) -> None:
+    """Ghi ra file tạm rồi os.replace → crash giữa chừng không để lại pickle hỏng."""
+    tmp = None
     try:
-        with open(DATA_FILE, "wb") as f:
-            pickle.dump(data, f)
-        print(f"✅ Đã lưu dữ liệu: {len(SUBSCRIBERS)} subscribers, {len(KNOWN_SYMBOLS)} coins")
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        with SAVE_LOCK:
+            # tên tạm riêng cho mỗi lần ghi, cùng thư mục với DATA_FILE để os.replace được
+            fd, tmp = tempfile.mkstemp(
+                prefix=os.path.basename(DATA_FILE) + ".",
+                suffix=".tmp",
+                dir=os.path.dirname(os.path.abspath(DATA_FILE)),
+            )
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.replace(tmp, DATA_FILE)
+                tmp = None
+            except OSError:
+                # DATA_FILE là bind mount (docker-compose) → không rename đè được, ghi thẳng
+                with open(DATA_FILE, "wb") as f:
+                    f.write(payload)
+        print(
+            f"✅ Đã lưu dữ liệu: {len(data['subscribers'])} subscribers, "
+            f"{len(data['known_symbols'])} coins"
+        )
     except Exception as e:
         print(f"⚠️ Lỗi lưu dữ liệu: {e}")
+    finally:
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def save_data() -> None:
+    """Lưu ngay (đồng bộ) - dùng khi tắt bot."""
+    SAVE_DIRTY.clear()
+    _write_data(_snapshot_data())
+
+
+async def save_data_async() -> None:
+    """Lưu trên thread riêng để không chặn event loop (recv WebSocket) khi đĩa chậm."""
+    await asyncio.to_thread(_write_data, _snapshot_data())
+
+
+def mark_dirty() -> None:
+    """Đánh dấu state đã đổi; save_worker sẽ gộp và lưu sau SAVE_DEBOUNCE_SECONDS."""
+    SAVE_DIRTY.set()
+
+
+async def save_worker_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job: gộp các lần thay đổi state, lưu tối đa 1 lần mỗi SAVE_DEBOUNCE_SECONDS."""
+    while True:
+        await SAVE_DIRTY.wait()
+        await asyncio.sleep(SAVE_DEBOUNCE_SECONDS)
+        SAVE_DIRTY.clear()
+        await save_data_async()
 
 
 def load_data() -> None:
@@ -115,6 +258,24 @@ def load_data() -> None:
 
 
 # ================== HTTP / MEXC UTIL ==================
+def get_http_session() -> aiohttp.ClientSession:
+    """Trả về session dùng chung, tạo mới nếu chưa có hoặc đã bị đóng."""
+    global HTTP_SESSION
+    if HTTP_SESSION is None or HTTP_SESSION.closed:
+        HTTP_SESSION = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=15),
+            connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300, keepalive_timeout=75),
+        )
+    return HTTP_SESSION
+
+
+async def close_http_session() -> None:
+    global HTTP_SESSION
+    if HTTP_SESSION is not None and not HTTP_SESSION.closed:
+        await HTTP_SESSION.close()
+    HTTP_SESSION = None
+
+
 async def fetch_json(session: aiohttp.ClientSession, url: str, params=None, retry: int = 3):
     """Gọi API, có retry nhẹ cho case lỗi mạng / 429."""
     import random
@@ -160,26 +321,69 @@ async def get_all_symbols(session: aiohttp.ClientSession) -> list[str]:
     return symbols
 
 
+def sub_frames(symbol: str) -> tuple[str, str]:
+    """Frame sub.ticker + sub.kline cho symbol (encode 1 lần, dùng lại khi reconnect)."""
+    frames = SUB_FRAME_CACHE.get(symbol)
+    if frames is None:
+        frames = (
+            orjson.dumps({"method": "sub.ticker", "param": {"symbol": symbol}}).decode(),
+            orjson.dumps(
+                {"method": "sub.kline", "param": {"symbol": symbol, "interval": KLINE_INTERVAL}}
+            ).decode(),
+        )
+        SUB_FRAME_CACHE[symbol] = frames
+    return frames
+
+
+def shard_of(symbol: str) -> int:
+    """Shard (kết nối WebSocket) phụ trách cả ticker lẫn kline của symbol.
+
+    Mỗi shard chỉ nhận dữ liệu của symbol mình → tải chia đều, 1 kết nối rớt chỉ mất
+    phần symbol của shard đó trong lúc reconnect.
+    """
+    return hash(symbol) % WS_SHARDS
+
+
+async def send_batched(ws, frames: list[str]) -> None:
+    """Gửi nhiều frame subscribe theo đợt WS_SUB_BATCH, không sleep giữa các frame."""
+    for i in range(0, len(frames), WS_SUB_BATCH):
+        await asyncio.gather(*(ws.send(f) for f in frames[i:i + WS_SUB_BATCH]))
+
+
 # ================== FORMAT MESSAGE ==================
+SYMBOL_META: dict[str, tuple[str, str]] = {}  # {symbol: (coin, link)} đã escape HTML
+_fmt_pct2 = "{:+.2f}%".format
+
+
+def symbol_meta(symbol: str) -> tuple[str, str]:
+    """(coin, link) cho symbol, đã html.escape - tính 1 lần rồi cache."""
+    meta = SYMBOL_META.get(symbol)
+    if meta is None:
+        meta = SYMBOL_META[symbol] = (
+            html.escape(symbol.removesuffix("_USDT")),
+            html.escape(f"https://www.mexc.co/futures/{symbol}"),
+        )
+    return meta
+
+
 def fmt_alert(symbol: str, old_price: float, new_price: float, change_pct: float) -> str:
     color = "🟢" if change_pct >= 0 else "🔴"
     abs_change = abs(change_pct)
 
     if abs_change >= EXTREME_THRESHOLD:
         icon = "🚀🚀🚀" if change_pct >= 0 else "💥💥💥"
-        highlight = "⚠️*BIẾN ĐỘNG CỰC MẠNH*⚠️\n"
-        size_tag = f"*{change_pct:+.2f}%*"
+        highlight = "⚠️<b>BIẾN ĐỘNG CỰC MẠNH</b>⚠️\n"
+        size_tag = f"<b>{_fmt_pct2(change_pct)}</b>"
     else:
         icon = "🚀🚀" if change_pct >= 0 else "💥💥"
         highlight = ""
-        size_tag = f"{change_pct:+.2f}%"
+        size_tag = _fmt_pct2(change_pct)
 
-    coin = symbol.replace("_USDT", "")
-    link = f"https://www.mexc.co/futures/{symbol}"
+    coin, link = symbol_meta(symbol)
 
     return (
         f"{highlight}"
-        f"┌{icon} [{coin}]({link}) ⚡ {size_tag} {color}\n"
+        f"┌{icon} <a href=\"{link}\">{coin}</a> ⚡ {size_tag} {color}\n"
         f"└ {old_price:.6g} → {new_price:.6g}"
     )
 
@@ -188,8 +392,7 @@ def fmt_countdown_alert(symbol: str, milestone: str, change_pct: float, max_chan
     """Format countdown alert cho 3 mốc: 60s, 15s, 0s"""
     abs_change = abs(change_pct)
     color = "🟢" if change_pct >= 0 else "🔴"
-    coin = symbol.replace("_USDT", "")
-    link = f"https://www.mexc.co/futures/{symbol}"
+    coin, link = symbol_meta(symbol)
     
     # Xác định icon và message dựa trên mốc
     if milestone == "60s":
@@ -201,11 +404,11 @@ def fmt_countdown_alert(symbol: str, milestone: str, change_pct: float, max_chan
             action = "Pump" if change_pct >= 0 else "Dump"
         
         return (
-            f"┌{icon} *Bot {action} sắp sàng!*\n"
-            f"├ [{coin}]({link}) {color}\n"
+            f"┌{icon} <b>Bot {action} sắp sàng!</b>\n"
+            f"├ <a href=\"{link}\">{coin}</a> {color}\n"
             f"├ Đã tải {len(ALL_SYMBOLS)} coins\n"
             f"├ Biến động hiện tại: {change_pct:+.2f}%\n"
-            f"└ ⏰ Theo dõi 60s nến đóng ({action.lower()} > {abs(PUMP_THRESHOLD if change_pct >= 0 else DUMP_THRESHOLD):.0f}%)"
+            f"└ ⏰ Theo dõi 60s nến đóng ({action.lower()} &gt; {abs(PUMP_THRESHOLD if change_pct >= 0 else DUMP_THRESHOLD):.0f}%)"
         )
     
     elif milestone == "15s":
@@ -216,8 +419,8 @@ def fmt_countdown_alert(symbol: str, milestone: str, change_pct: float, max_chan
         
         action = "pump" if change_pct >= 0 else "dump"
         return (
-            f"┌{icon} *Alert trước 15s khi {action} > {abs(PUMP_THRESHOLD if change_pct >= 0 else DUMP_THRESHOLD):.0f}%*\n"
-            f"├ [{coin}]({link}) {color}\n"
+            f"┌{icon} <b>Alert trước 15s khi {action} &gt; {abs(PUMP_THRESHOLD if change_pct >= 0 else DUMP_THRESHOLD):.0f}%</b>\n"
+            f"├ <a href=\"{link}\">{coin}</a> {color}\n"
             f"├ Biến động: {change_pct:+.2f}% (max: {max_change_pct:+.2f}%)\n"
             f"└ ⏰ Còn ~{seconds_left}s nến đóng"
         )
@@ -230,11 +433,11 @@ def fmt_countdown_alert(symbol: str, milestone: str, change_pct: float, max_chan
         
         action = "Pump" if change_pct >= 0 else "Dump"
         return (
-            f"┌{icon} *Bot {action} khởi động*\n"
-            f"├ [{coin}]({link}) {color}\n"
+            f"┌{icon} <b>Bot {action} khởi động</b>\n"
+            f"├ <a href=\"{link}\">{coin}</a> {color}\n"
             f"├ Theo dõi {len(ALL_SYMBOLS)} coins\n"
             f"├ Kết quả: {change_pct:+.2f}% (max: {max_change_pct:+.2f}%)\n"
-            f"└ ⏰ Alert trước 15s khi {action.lower()} > {abs(PUMP_THRESHOLD if change_pct >= 0 else DUMP_THRESHOLD):.0f}%"
+            f"└ ⏰ Alert trước 15s khi {action.lower()} &gt; {abs(PUMP_THRESHOLD if change_pct >= 0 else DUMP_THRESHOLD):.0f}%"
         )
 
 
@@ -303,8 +506,7 @@ def fmt_ohlc_alert(symbol: str, ohlc: dict) -> str:
             icon = "⚠️"
             action = "BIẾN ĐỘNG"
     
-    coin = symbol.replace("_USDT", "")
-    link = f"https://www.mexc.co/futures/{symbol}"
+    coin, link = symbol_meta(symbol)
     
     # Thêm warning nếu có rút râu mạnh
     wick_warning = ""
@@ -315,16 +517,52 @@ def fmt_ohlc_alert(symbol: str, ohlc: dict) -> str:
     if is_extreme:
         # EXTREME: Format 1 dòng nổi bật, dễ scan
         return (
-            f"{icon} [{coin}]({link}) {color} "
-            f"*{change_pct:+.1f}%* (biên độ {range_pct:.1f}%){wick_warning}"
+            f"{icon} <a href=\"{link}\">{coin}</a> {color} "
+            f"<b>{change_pct:+.1f}%</b> (biên độ {range_pct:.1f}%){wick_warning}"
         )
     else:
         # NORMAL: Format 2 dòng compact
         return (
-            f"{icon} [{coin}]({link}) {color}\n"
+            f"{icon} <a href=\"{link}\">{coin}</a> {color}\n"
             f"{change_pct:+.1f}% • Biên độ {range_pct:.1f}%{wick_warning}"
         )
 
+def needs_dm(chat_id: int) -> bool:
+    """False nếu chat nhận y hệt nội dung channel (mode 1, không mute) → không cần nhắn riêng."""
+    if not (CHANNEL_ID and CHANNEL_LINK and CHANNEL_DEDUP_DM):
+        return True
+    return ALERT_MODE.get(chat_id, 1) != 1 or bool(MUTED_COINS.get(chat_id))
+
+
+def rebuild_sub_index() -> None:
+    """Dựng lại ELIGIBLE_SUBS_BY_MODE / MUTED_SYMBOLS_INDEX sau khi subscribers/mode/mute đổi."""
+    global ELIGIBLE_SUBS_BY_MODE, MUTED_SYMBOLS_INDEX
+    by_mode: dict[int, set[int]] = {1: set(), 2: set(), 3: set()}
+    for chat_id in SUBSCRIBERS:
+        if needs_dm(chat_id):
+            by_mode.setdefault(ALERT_MODE.get(chat_id, 1), set()).add(chat_id)
+
+    muted_index: dict[str, set[int]] = {}
+    for chat_id, symbols in MUTED_COINS.items():
+        for sym in symbols:
+            muted_index.setdefault(sym, set()).add(chat_id)
+
+    # gán object mới (không clear/update tại chỗ) vì WS thread đọc song song
+    ELIGIBLE_SUBS_BY_MODE = by_mode
+    MUTED_SYMBOLS_INDEX = muted_index
+
+
+def dm_targets(symbol: str, max_signal: float) -> set[int]:
+    """Các chat cần nhắn riêng alert của `symbol` (đã lọc mode + mute)."""
+    # Mode 1: tất cả; mode 2: chỉ < 10%; mode 3: chỉ ≥ 10%
+    band_mode = 3 if max_signal >= EXTREME_THRESHOLD else 2
+    targets = ELIGIBLE_SUBS_BY_MODE[1] | ELIGIBLE_SUBS_BY_MODE[band_mode]
+    muted = MUTED_SYMBOLS_INDEX.get(symbol)
+    if muted:
+        targets -= muted
+    return targets
+
+
 # ================== ADMIN CHECK DECORATOR ==================
 def admin_only(func):
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -353,6 +591,8 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     SUBSCRIBERS.add(chat_id)
     if chat_id not in ALERT_MODE:
         ALERT_MODE[chat_id] = 1
+    rebuild_sub_index()
+    mark_dirty()
 
     mode = ALERT_MODE.get(chat_id, 1)
     if mode == 1:
@@ -380,54 +620,62 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/timelist – xem lịch coin sắp list\n"
         "/coinlist – coin đã list 1 tuần qua\n"
     )
+    if CHANNEL_ID and CHANNEL_LINK:
+        text += f"\n📢 Alert đầy đủ trong channel: [tham gia channel]({CHANNEL_LINK})\n"
+        if CHANNEL_DEDUP_DM:
+            text += "_Bot chỉ nhắn riêng khi bạn dùng /mode2, /mode3 hoặc /mute._\n"
     await update.effective_message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
-    save_data()
 
 
 @admin_only
 async def cmd_subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     SUBSCRIBERS.add(chat_id)
+    rebuild_sub_index()
+    mark_dirty()
     await update.effective_message.reply_text("✅ Đã bật báo!")
-    save_data()
 
 
 @admin_only
 async def cmd_unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     SUBSCRIBERS.discard(chat_id)
+    rebuild_sub_index()
+    mark_dirty()
     await update.effective_message.reply_text("✅ Đã tắt báo!")
-    save_data()
 
 
 @admin_only
 async def cmd_mode1(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ALERT_MODE[update.effective_chat.id] = 1
+    rebuild_sub_index()
+    mark_dirty()
     await update.effective_message.reply_text(
         "✅ Mode 1: báo *TẤT CẢ* biến động (3–5% + ≥10%)",
         parse_mode=ParseMode.MARKDOWN,
     )
-    save_data()
 
 
 @admin_only
 async def cmd_mode2(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ALERT_MODE[update.effective_chat.id] = 2
+    rebuild_sub_index()
+    mark_dirty()
     await update.effective_message.reply_text(
         "✅ Mode 2: *chỉ báo 3–5%*, bỏ qua ≥10%",
         parse_mode=ParseMode.MARKDOWN,
     )
-    save_data()
 
 
 @admin_only
 async def cmd_mode3(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ALERT_MODE[update.effective_chat.id] = 3
+    rebuild_sub_index()
+    mark_dirty()
     await update.effective_message.reply_text(
         "✅ Mode 3: *chỉ báo ≥10%*, bỏ qua 3–5%",
         parse_mode=ParseMode.MARKDOWN,
     )
-    save_data()
 
 
 @admin_only
@@ -445,11 +693,12 @@ async def cmd_mute(update: Update, context: ContextTypes.DEFAULT_TYPE):
     symbol = f"{coin}_USDT" if not coin.endswith("_USDT") else coin
 
     MUTED_COINS.setdefault(chat_id, set()).add(symbol)
+    rebuild_sub_index()
+    mark_dirty()
     await update.effective_message.reply_text(
         f"🔇 Đã tắt thông báo cho `{coin}`",
         parse_mode=ParseMode.MARKDOWN,
     )
-    save_data()
 
 
 @admin_only
@@ -468,11 +717,12 @@ async def cmd_unmute(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if chat_id in MUTED_COINS and symbol in MUTED_COINS[chat_id]:
         MUTED_COINS[chat_id].remove(symbol)
+        rebuild_sub_index()
+        mark_dirty()
         await update.effective_message.reply_text(
             f"🔔 Đã bật lại `{coin}`",
             parse_mode=ParseMode.MARKDOWN,
         )
-        save_data()
     else:
         await update.effective_message.reply_text(
             f"ℹ️ `{coin}` hiện chưa bị mute",
@@ -498,14 +748,14 @@ async def cmd_mutelist(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cmd_timelist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_message.reply_text("⏳ Đang lấy lịch listing…")
     try:
-        async with aiohttp.ClientSession() as session:
-            timestamp = int(datetime.now().timestamp() * 1000)
-            url = f"https://www.mexc.co/api/operation/new_coin_calendar?timestamp={timestamp}"
+        session = get_http_session()
+        timestamp = int(datetime.now().timestamp() * 1000)
+        url = f"https://www.mexc.co/api/operation/new_coin_calendar?timestamp={timestamp}"
 
-            async with session.get(url, timeout=15) as r:
-                if r.status != 200:
-                    raise RuntimeError(f"HTTP {r.status}")
-                data = await r.json()
+        async with session.get(url, timeout=15) as r:
+            if r.status != 200:
+                raise RuntimeError(f"HTTP {r.status}")
+            data = await r.json()
 
         coins = data.get("data", {}).get("newCoins", [])
         if not coins:
@@ -556,14 +806,14 @@ async def cmd_timelist(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cmd_coinlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_message.reply_text("⏳ Đang lấy danh sách coin mới…")
     try:
-        async with aiohttp.ClientSession() as session:
-            timestamp = int(datetime.now().timestamp() * 1000)
-            url = f"https://www.mexc.co/api/operation/new_coin_calendar?timestamp={timestamp}"
+        session = get_http_session()
+        timestamp = int(datetime.now().timestamp() * 1000)
+        url = f"https://www.mexc.co/api/operation/new_coin_calendar?timestamp={timestamp}"
 
-            async with session.get(url, timeout=15) as r:
-                if r.status != 200:
-                    raise RuntimeError(f"HTTP {r.status}")
-                data = await r.json()
+        async with session.get(url, timeout=15) as r:
+            if r.status != 200:
+                raise RuntimeError(f"HTTP {r.status}")
+            data = await r.json()
 
         coins = data.get("data", {}).get("newCoins", [])
         if not coins:
@@ -611,8 +861,132 @@ async def cmd_coinlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+# ================== TELEGRAM SEND QUEUE ==================
+class RateLimiter:
+    """Token bucket đơn giản: tối đa `rate` lần mỗi `period` giây."""
+
+    def __init__(self, rate: float, period: float = 1.0):
+        self.rate = rate
+        self.period = period
+        self._tokens = rate
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    self._tokens = min(
+                        self.rate,
+                        self._tokens + (now - self._updated) * self.rate / self.period,
+                    )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.period / self.rate)
+
+
+SEND_LIMITER = RateLimiter(SEND_GLOBAL_RATE, 1.0)
+CHAT_NEXT_SEND: dict[int | str, float] = {}  # {chat_id: slot kế tiếp còn trống (chưa cộng CHAT_DELAY)}
+CHAT_DELAY: dict[int | str, float] = {}      # {chat_id: độ lùi tích luỹ do 429 RetryAfter}
+
+
+def _put_send(
+    chat_id: int | str,
+    text: str,
+    slot: float | None = None,
+    enqueued_at: float | None = None,
+) -> None:
+    if enqueued_at is None:
+        enqueued_at = time.monotonic()
+    try:
+        SEND_QUEUE.put_nowait((chat_id, text, slot, enqueued_at))
+    except asyncio.QueueFull:
+        print(f"⚠️ SEND_QUEUE đầy, bỏ alert cho {chat_id}")
+
+
+def enqueue_send(chat_id: int | str, text: str) -> None:
+    """Đưa alert vào SEND_QUEUE (không chờ Telegram); gọi được từ cả WS thread."""
+    if SEND_QUEUE is None:
+        print(f"⚠️ SEND_QUEUE chưa khởi tạo, bỏ qua alert cho {chat_id}")
+        return
+    if threading.get_ident() == WS_THREAD_ID:
+        # asyncio.Queue không thread-safe → chuyển việc put sang loop Telegram
+        MAIN_LOOP.call_soon_threadsafe(_put_send, chat_id, text, None, time.monotonic())
+    else:
+        _put_send(chat_id, text)
+
+
+async def send_worker(bot) -> None:
+    """Lấy (chat_id, text, slot, enqueued_at) từ SEND_QUEUE và gửi, tôn trọng giới hạn global + per-chat.
+
+    Chat chưa tới lượt (hoặc đang bị 429) thì item được giữ chỗ và đưa lại queue bằng
+    call_later, worker không ngủ chờ 1 chat (burst vào channel không chặn DM của chat khác).
+    429 lùi cả lịch của chat đó (CHAT_DELAY) nên thứ tự + giãn cách vẫn giữ nguyên.
+    Alert chờ quá SEND_MAX_AGE giây thì bỏ, không gửi trễ.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        chat_id, text, slot, enqueued_at = await SEND_QUEUE.get()
+        try:
+            now = loop.time()
+            delay = CHAT_DELAY.get(chat_id, 0.0)
+            if slot is None:
+                # giữ chỗ slot tiếp theo cho chat này (giữ thứ tự tin trong cùng chat)
+                interval = SEND_CHANNEL_INTERVAL if chat_id == CHANNEL_ID else SEND_PER_CHAT_INTERVAL
+                slot = max(now - delay, CHAT_NEXT_SEND.get(chat_id, now - delay))
+                CHAT_NEXT_SEND[chat_id] = slot + interval
+
+            due = slot + delay
+            if time.monotonic() - enqueued_at + max(0.0, due - now) > SEND_MAX_AGE:
+                print(f"⚠️ Alert cho {chat_id} chờ quá {SEND_MAX_AGE:.0f}s, bỏ")
+                continue
+            if due > now:
+                loop.call_later(due - now, _put_send, chat_id, text, slot, enqueued_at)
+                continue
+
+            await SEND_LIMITER.acquire()
+            try:
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode=ParseMode.HTML,
+                    disable_web_page_preview=True,
+                )
+            except RetryAfter as e:
+                # không ngủ trong worker: lùi lịch của chat này rồi đưa item lại queue
+                wait = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                print(f"⚠️ Telegram 429 cho {chat_id}, thử lại sau {wait}s")
+                retry_at = loop.time() + wait
+                CHAT_DELAY[chat_id] = max(CHAT_DELAY.get(chat_id, 0.0), retry_at - slot)
+                loop.call_later(wait, _put_send, chat_id, text, slot, enqueued_at)
+        except Exception as e:
+            print(f"❌ Lỗi gửi alert tới {chat_id}: {e}")
+        finally:
+            SEND_QUEUE.task_done()
+
+
+async def send_workers_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job wrapper chạy các worker gửi Telegram sau khi Application đã chạy."""
+    await asyncio.gather(*(send_worker(context.bot) for _ in range(SEND_WORKERS)))
+
+
 # ================== WEBSOCKET & PUMP/DUMP LOGIC ==================
-async def process_kline(bot, kline_data: dict):
+def _num(d: dict, key: str) -> float:
+    """Lấy số từ JSON: orjson đã trả int/float thì dùng luôn, chỉ parse khi MEXC gửi dạng chuỗi."""
+    v = d.get(key)
+    if v.__class__ is float or v.__class__ is int:
+        return v
+    try:
+        return float(v) if v else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def process_kline(kline_data: dict):
     """Xử lý dữ liệu Kline (OHLC) và gửi alert nếu biến động/biên độ >= ngưỡng."""
     symbol = kline_data.get("symbol")
     if not symbol:
@@ -620,18 +994,18 @@ async def process_kline(bot, kline_data: dict):
     
     try:
         # Parse OHLC data
-        open_price = float(kline_data.get("o", 0))
-        high_price = float(kline_data.get("h", 0))
-        low_price = float(kline_data.get("l", 0))
-        close_price = float(kline_data.get("c", 0))
-        volume = float(kline_data.get("v", 0))
-        amount = float(kline_data.get("a", 0))
-        
+        open_price = _num(kline_data, "o")
+        low_price = _num(kline_data, "l")
         if open_price <= 0 or low_price <= 0:
             return
+
+        high_price = _num(kline_data, "h")
+        close_price = _num(kline_data, "c")
+        volume = _num(kline_data, "v")
+        amount = _num(kline_data, "a")
         
-        # Lưu OHLC data
-        now = datetime.now()
+        # Lưu OHLC data (time.monotonic: chỉ dùng tính khoảng thời gian)
+        now = time.monotonic()
         OHLC_DATA[symbol] = {
             "open": open_price,
             "high": high_price,
@@ -656,7 +1030,7 @@ async def process_kline(bot, kline_data: dict):
         
         # Check cooldown để tránh spam
         if symbol in OHLC_LAST_ALERT:
-            elapsed = (now - OHLC_LAST_ALERT[symbol]).total_seconds()
+            elapsed = now - OHLC_LAST_ALERT[symbol]
             if elapsed < OHLC_COOLDOWN_SECONDS:
                 return
         
@@ -670,107 +1044,81 @@ async def process_kline(bot, kline_data: dict):
         max_pct = max(abs_change, range_pct)
         print(f"📊 OHLC ALERT {symbol}: {signal_type} {max_pct:.2f}% (change={change_pct:+.2f}%, range={range_pct:.2f}%)")
         
-        tasks = []
-        
         # Gửi vào channel nếu có
         if CHANNEL_ID:
-            tasks.append(
-                bot.send_message(
-                    chat_id=CHANNEL_ID,
-                    text=msg,
-                    parse_mode=ParseMode.MARKDOWN,
-                    disable_web_page_preview=True,
-                )
-            )
+            enqueue_send(CHANNEL_ID, msg)
         
-        # Gửi cho subscribers
-        for chat_id in list(SUBSCRIBERS):
-            if chat_id in MUTED_COINS and symbol in MUTED_COINS[chat_id]:
-                continue
-            
-            mode = ALERT_MODE.get(chat_id, 1)
-            # Tính max signal để check mode
-            max_signal = max(abs_change, range_pct)
-            
-            # Mode 2: chỉ 3–5% - chỉ gửi nếu max_signal < 10%
-            if mode == 2 and max_signal >= EXTREME_THRESHOLD:
-                continue
-            # Mode 3: chỉ ≥10% - chỉ gửi nếu max_signal >= 10%
-            if mode == 3 and max_signal < EXTREME_THRESHOLD:
-                continue
-            
-            tasks.append(
-                bot.send_message(
-                    chat_id=chat_id,
-                    text=msg,
-                    parse_mode=ParseMode.MARKDOWN,
-                    disable_web_page_preview=True,
-                )
-            )
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        # Gửi cho subscribers (đã lọc mode/mute theo max signal)
+        for chat_id in dm_targets(symbol, max_pct):
+            enqueue_send(chat_id, msg)
     
     except Exception as e:
         print(f"❌ Error processing kline for {symbol}: {e}")
 
 
-async def process_ticker(bot, ticker_data: dict):
+async def process_ticker(ticker_data: dict):
     """Xử lý 1 gói ticker và gửi alert nếu vượt ngưỡng (không hạn chế lặp)."""
     symbol = ticker_data.get("symbol")
     if not symbol:
         return
 
     try:
-        current_price = float(ticker_data.get("lastPrice", 0))
-        
+        current_price = _num(ticker_data, "lastPrice")
+        if current_price <= 0:
+            return
+
         # Lấy volume USDT 24h (không phải volume coin)
         # MEXC API: amount24 = volume tính theo USDT
-        volume_usdt = float(ticker_data.get("amount24", 0))
-        
+        volume_usdt = _num(ticker_data, "amount24")
+
         # Fallback: nếu không có amount24, tính từ volume24 * price
         if volume_usdt == 0:
-            volume_coin = float(ticker_data.get("volume24", 0))
-            volume_usdt = volume_coin * current_price
+            volume_usdt = _num(ticker_data, "volume24") * current_price
 
-        if current_price <= 0 or volume_usdt < MIN_VOL_THRESHOLD:
+        if volume_usdt < MIN_VOL_THRESHOLD:
             return
 
-        now = datetime.now()
+        now = time.monotonic()
+
+        st = SYMBOL_STATE.get(symbol)
+        if st is None:
+            st = SYMBOL_STATE[symbol] = SymbolState()
 
         # lưu giá gần nhất
-        LAST_PRICES[symbol] = {"price": current_price, "time": now}
+        st.last_price = current_price
+        st.last_time = now
 
         # tạo base price nếu chưa có
-        if symbol not in BASE_PRICES:
-            BASE_PRICES[symbol] = current_price
+        if st.base_price is None:
+            st.base_price = current_price
             return
 
-        base_price = BASE_PRICES[symbol]
+        base_price = st.base_price
         price_change = (current_price - base_price) / base_price * 100
         abs_change = abs(price_change)
 
         # track max change (chỉ để log)
-        if symbol not in MAX_CHANGES:
-            MAX_CHANGES[symbol] = {"max_pct": price_change, "time": now}
-        else:
-            if abs(price_change) > abs(MAX_CHANGES[symbol]["max_pct"]):
-                MAX_CHANGES[symbol]["max_pct"] = price_change
-                MAX_CHANGES[symbol]["time"] = now
-                LAST_SIGNIFICANT_CHANGE[symbol] = now
+        if st.max_pct is None:
+            st.max_pct = price_change
+            st.max_time = now
+        elif abs_change > abs(st.max_pct):
+            st.max_pct = price_change
+            st.max_time = now
+            st.last_significant = now
 
         # điều kiện reset base (để không bị drift quá xa)
         should_reset_base = False
         if abs_change < 1.5:
             should_reset_base = True
-        elif symbol in LAST_SIGNIFICANT_CHANGE:
+        elif st.last_significant is not None:
             # Giảm từ 50s → 30s để phản ứng nhanh hơn với biến động lớn
-            if (now - LAST_SIGNIFICANT_CHANGE[symbol]).total_seconds() > 30:
+            if now - st.last_significant > 30:
                 should_reset_base = True
 
         if should_reset_base:
-            BASE_PRICES[symbol] = current_price
-            MAX_CHANGES[symbol] = {"max_pct": 0.0, "time": now}
+            st.base_price = current_price
+            st.max_pct = 0.0
+            st.max_time = now
 
         # =============== HYBRID: TICKER TRIGGER + OHLC DISPLAY ===============
         # Ticker phát hiện nhanh, OHLC cung cấp % chính xác
@@ -781,7 +1129,7 @@ async def process_ticker(bot, ticker_data: dict):
         
         # Check cooldown để tránh spam (dùng chung với OHLC)
         if symbol in OHLC_LAST_ALERT:
-            elapsed = (now - OHLC_LAST_ALERT[symbol]).total_seconds()
+            elapsed = now - OHLC_LAST_ALERT[symbol]
             if elapsed < OHLC_COOLDOWN_SECONDS:
                 return
         
@@ -816,166 +1164,186 @@ async def process_ticker(bot, ticker_data: dict):
         OHLC_LAST_ALERT[symbol] = now
 
         # gửi vào channel nếu có
-        tasks = []
-
         if CHANNEL_ID:
-            tasks.append(
-                bot.send_message(
-                    chat_id=CHANNEL_ID,
-                    text=msg,
-                    parse_mode=ParseMode.MARKDOWN,
-                    disable_web_page_preview=True,
-                )
-            )
+            enqueue_send(CHANNEL_ID, msg)
 
         # gửi cho subscribers với mode filtering dựa trên max_signal từ OHLC
-        for chat_id in list(SUBSCRIBERS):
-            if chat_id in MUTED_COINS and symbol in MUTED_COINS[chat_id]:
-                continue
-
-            mode = ALERT_MODE.get(chat_id, 1)
-            # Mode 2: chỉ 3–5% - skip nếu max_signal >= 10%
-            if mode == 2 and max_signal >= EXTREME_THRESHOLD:
-                continue
-            # Mode 3: chỉ ≥10% - skip nếu max_signal < 10%
-            if mode == 3 and max_signal < EXTREME_THRESHOLD:
-                continue
-
-            tasks.append(
-                bot.send_message(
-                    chat_id=chat_id,
-                    text=msg,
-                    parse_mode=ParseMode.MARKDOWN,
-                    disable_web_page_preview=True,
-                )
-            )
-        
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        for chat_id in dm_targets(symbol, max_signal):
+            enqueue_send(chat_id, msg)
 
     except Exception as e:
         print(f"❌ Error processing ticker for {symbol}: {e}")
 
 
-async def websocket_stream(application: Application):
-    """Lắng nghe WebSocket ticker của MEXC và gọi process_ticker()."""
-    global ALL_SYMBOLS, KNOWN_SYMBOLS, WS_SUB_QUEUE
+class FastQueue:
+    """Queue tối giản (deque + Future) cho TICK_QUEUE - ít bookkeeping hơn asyncio.Queue.
 
-    reconnect_delay = 5
+    Đầy (maxlen) thì deque tự bỏ phần tử cũ nhất để giữ dữ liệu mới.
+    """
+
+    def __init__(self, maxlen: int | None = None):
+        self._items: collections.deque = collections.deque(maxlen=maxlen)
+        self._waiters: collections.deque = collections.deque()
+
+    def __len__(self) -> int:
+        return len(self._items)
 
+    def _wakeup_next(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def put_nowait(self, item) -> None:
+        self._items.append(item)
+        if self._waiters:
+            self._wakeup_next()
+
+    async def get(self):
+        while not self._items:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # đã được đánh thức nhưng bị cancel → nhường cho consumer khác
+                if self._items:
+                    self._wakeup_next()
+                raise
+        return self._items.popleft()
+
+
+async def tick_worker():
+    """Xử lý frame ticker/kline tách khỏi vòng recv WebSocket."""
     while True:
+        channel, payload = await TICK_QUEUE.get()
         try:
-            # Khởi tạo queue nếu chưa có
-            if WS_SUB_QUEUE is None:
-                WS_SUB_QUEUE = asyncio.Queue()
+            if channel == "push.ticker":
+                await process_ticker(payload)
+            else:
+                await process_kline(payload)
+        except Exception as e:
+            # frame lỗi (data null / không phải dict) không được làm chết worker
+            print(f"❌ tick_worker: lỗi xử lý {channel}: {e}")
+
+
+async def websocket_stream(application: Application, shard: int = 0):
+    """Lắng nghe WebSocket ticker của MEXC cho các symbol thuộc `shard` và đẩy vào TICK_QUEUE.
 
+    Mỗi shard sub ticker + kline cho đúng các symbol của mình.
+    """
+    global ALL_SYMBOLS, KNOWN_SYMBOLS
+
+    reconnect_delay = 5
+    sub_queue = WS_SUB_QUEUES[shard]
+    tag = f"[WS {shard}]"
+
+    # lệch giờ connect giữa các shard để các đợt subscribe không dồn vào cùng lúc
+    await asyncio.sleep(shard * WS_SHARD_STAGGER)
+
+    while True:
+        try:
             # Nếu chưa có danh sách symbol thì fetch
             if not ALL_SYMBOLS:
+                # HTTP_SESSION thuộc loop Telegram → dùng session tạm trên WS loop
                 async with aiohttp.ClientSession() as session:
-                    ALL_SYMBOLS = await get_all_symbols(session)
-                    if not KNOWN_SYMBOLS:
-                        KNOWN_SYMBOLS = set(ALL_SYMBOLS)
+                    ALL_SYMBOLS = set(await get_all_symbols(session))
+                if not KNOWN_SYMBOLS:
+                    KNOWN_SYMBOLS = set(ALL_SYMBOLS)
 
             async with websockets.connect(
                 WEBSOCKET_URL,
                 ping_interval=20,
                 ping_timeout=10,
                 close_timeout=10,
+                compression="deflate",
+                max_size=WS_MAX_SIZE,
+                max_queue=WS_MAX_QUEUE,
+                read_limit=WS_READ_LIMIT,
+                write_limit=WS_WRITE_LIMIT,
             ) as ws:
-                print("✅ Kết nối WebSocket thành công")
+                print(f"✅ {tag} Kết nối WebSocket thành công")
                 reconnect_delay = 5
 
-                # Subscribe tất cả symbol hiện có (cả ticker và kline)
-                for sym in ALL_SYMBOLS:
-                    # Subscribe ticker
-                    sub_ticker = {
-                        "method": "sub.ticker",
-                        "param": {"symbol": sym},
-                    }
-                    await ws.send(json.dumps(sub_ticker))
-                    
-                    # Subscribe kline (nến 1 phút)
-                    sub_kline = {
-                        "method": "sub.kline",
-                        "param": {"symbol": sym, "interval": KLINE_INTERVAL},
-                    }
-                    await ws.send(json.dumps(sub_kline))
-                    await asyncio.sleep(0.005)
-
-                print(f"✅ Đã subscribe {len(ALL_SYMBOLS)} coin (ticker + kline {KLINE_INTERVAL})")
+                # Sub ticker + kline từng coin, gửi pipeline theo đợt.
+                # Không dùng sub.tickers: push.tickers chỉ có volume24 (số hợp đồng, chưa nhân
+                # contractSize), không có amount24 → làm sai lọc MIN_VOL_THRESHOLD.
+                # (copy vì job_new_listing có thể add vào set trong lúc await send)
+                symbols = [sym for sym in list(ALL_SYMBOLS) if shard_of(sym) == shard]
+                await send_batched(ws, [frame for sym in symbols for frame in sub_frames(sym)])
+
+                print(f"✅ {tag} Đã subscribe {len(symbols)} coin (ticker + kline {KLINE_INTERVAL})")
 
                 # Vòng lặp nhận dữ liệu
                 async for message in ws:
+                    # Ping/pong fast-path: {"ping":<ts>} → {"pong":<ts>} không cần decode JSON
+                    if isinstance(message, str) and message.startswith(WS_PING_PREFIX) and message.endswith("}"):
+                        await ws.send(WS_PONG_PREFIX + message[len(WS_PING_PREFIX):])
+                        continue
+
                     try:
-                        data = json.loads(message)
-                    except json.JSONDecodeError:
+                        data = orjson.loads(message)
+                    except orjson.JSONDecodeError:
                         continue
 
                     # Ping/pong
                     if "ping" in data:
-                        await ws.send(json.dumps({"pong": data["ping"]}))
+                        await ws.send(orjson.dumps({"pong": data["ping"]}).decode())
                         continue
 
-                    # Ticker data
-                    if data.get("channel") == "push.ticker" and "data" in data:
-                        await process_ticker(application.bot, data["data"])
-                    
-                    # Kline data (OHLC)
-                    if data.get("channel") == "push.kline" and "data" in data:
-                        await process_kline(application.bot, data["data"])
+                    # Ticker / Kline (OHLC) data → TICK_QUEUE cho tick_worker
+                    channel = data.get("channel")
+                    if channel in ("push.ticker", "push.kline") and "data" in data:
+                        TICK_QUEUE.put_nowait((channel, data["data"]))
 
                     # SAU KHI XỬ LÝ TICKER → CHECK XEM CÓ COIN MỚI CẦN SUB KHÔNG
-                    if WS_SUB_QUEUE is not None:
-                        while not WS_SUB_QUEUE.empty():
+                    while not sub_queue.empty():
+                        try:
+                            new_sym = await sub_queue.get()
+                        except Exception:
+                            break
+
+                        # set → không bị trùng symbol
+                        ALL_SYMBOLS.add(new_sym)
+
+                        sub_ticker, sub_kline = sub_frames(new_sym)
+                        try:
+                            await ws.send(sub_ticker)
+                            await ws.send(sub_kline)
+                            print(f"📡 Đã subscribe thêm coin mới: {new_sym} (ticker + kline)")
+                        except Exception as e:
+                            print(f"⚠️ Lỗi khi subscribe thêm {new_sym}: {e}")
+                            # nếu lỗi, cho vào queue lại để thử ở vòng sau
                             try:
-                                new_sym = await WS_SUB_QUEUE.get()
+                                sub_queue.put_nowait(new_sym)
                             except Exception:
-                                break
-
-                            # tránh subscribe trùng
-                            if new_sym not in ALL_SYMBOLS:
-                                ALL_SYMBOLS.append(new_sym)
-
-                            sub_ticker = {
-                                "method": "sub.ticker",
-                                "param": {"symbol": new_sym},
-                            }
-                            sub_kline = {
-                                "method": "sub.kline",
-                                "param": {"symbol": new_sym, "interval": KLINE_INTERVAL},
-                            }
-                            try:
-                                await ws.send(json.dumps(sub_ticker))
-                                await ws.send(json.dumps(sub_kline))
-                                print(f"📡 Đã subscribe thêm coin mới: {new_sym} (ticker + kline)")
-                            except Exception as e:
-                                print(f"⚠️ Lỗi khi subscribe thêm {new_sym}: {e}")
-                                # nếu lỗi, cho vào queue lại để thử ở vòng sau
-                                try:
-                                    WS_SUB_QUEUE.put_nowait(new_sym)
-                                except Exception:
-                                    pass
+                                pass
 
         except Exception as e:
-            print(f"❌ WebSocket error: {e}")
-            print(f"🔄 Thử reconnect sau {reconnect_delay}s…")
+            print(f"❌ {tag} WebSocket error: {e}")
+            print(f"🔄 {tag} Thử reconnect sau {reconnect_delay}s…")
             await asyncio.sleep(reconnect_delay)
             reconnect_delay = min(reconnect_delay * 2, 60)
 
 
 # ================== JOBS ==================
-async def job_reset_base_prices(context: ContextTypes.DEFAULT_TYPE):
-    """Job backup: mỗi 5 phút reset base price cho coin không alert gần đây."""
-    now = datetime.now()
-    reset_count = 0
-    for symbol, info in list(LAST_PRICES.items()):
-        last_price = info["price"]
-        last_alert = ALERTED_SYMBOLS.get(symbol)
-        if not last_alert or (now - last_alert).total_seconds() > 300:
-            BASE_PRICES[symbol] = last_price
-            reset_count += 1
-    if reset_count:
-        print(f"🔄 Backup reset base price cho {reset_count} symbol")
+async def reset_base_prices_loop():
+    """Backup: mỗi 5 phút reset base price cho coin không alert gần đây.
+
+    Chạy trên WS loop (cùng process_ticker) để chỉ 1 thread chạm vào SYMBOL_STATE.
+    """
+    while True:
+        await asyncio.sleep(300)
+        threshold = time.monotonic() - 300
+        resets = [
+            st for st in SYMBOL_STATE.values()
+            if st.last_alert is None or st.last_alert < threshold
+        ]
+        for st in resets:
+            st.base_price = st.last_price
+        if resets:
+            print(f"🔄 Backup reset base price cho {len(resets)} symbol")
 
 
 async def job_new_listing(context: ContextTypes.DEFAULT_TYPE):
@@ -983,18 +1351,17 @@ async def job_new_listing(context: ContextTypes.DEFAULT_TYPE):
     if not SUBSCRIBERS and not CHANNEL_ID:
         return
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            symbols = await get_all_symbols(session)
-        except Exception as e:
-            print(f"❌ job_new_listing: get_all_symbols error {e}")
-            return
+    try:
+        symbols = await get_all_symbols(get_http_session())
+    except Exception as e:
+        print(f"❌ job_new_listing: get_all_symbols error {e}")
+        return
 
     global KNOWN_SYMBOLS
     if not KNOWN_SYMBOLS:
         KNOWN_SYMBOLS = set(symbols)
         print(f"✅ job_new_listing: init {len(KNOWN_SYMBOLS)} coins")
-        save_data()
+        mark_dirty()
         return
 
     new_coins = set(symbols) - KNOWN_SYMBOLS
@@ -1002,57 +1369,76 @@ async def job_new_listing(context: ContextTypes.DEFAULT_TYPE):
         return
 
     KNOWN_SYMBOLS.update(new_coins)
-    save_data()
+    mark_dirty()
 
     lines = []
     for sym in sorted(new_coins):
         coin = sym.replace("_USDT", "")
-        lines.append(f"🆕 *COIN MỚI LIST FUTURES:* `{coin}`")
+        lines.append(f"🆕 <b>COIN MỚI LIST FUTURES:</b> <code>{html.escape(coin)}</code>")
 
     text = "\n".join(lines)
-    bot = context.bot
 
-    # gửi vào channel
+    # gửi vào channel (qua SEND_QUEUE như alert)
     if CHANNEL_ID:
-        try:
-            await bot.send_message(
-                chat_id=CHANNEL_ID,
-                text=text,
-                parse_mode=ParseMode.MARKDOWN,
-            )
-        except Exception as e:
-            print(f"❌ job_new_listing: send to channel error {e}")
+        enqueue_send(CHANNEL_ID, text)
 
-    # gửi cho subscribers
+    # gửi cho subscribers (qua SEND_QUEUE để chịu chung rate limit)
     for chat_id in list(SUBSCRIBERS):
-        try:
-            await bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                parse_mode=ParseMode.MARKDOWN,
-            )
-        except Exception as e:
-            print(f"❌ job_new_listing: send to {chat_id} error {e}")
+        if needs_dm(chat_id):
+            enqueue_send(chat_id, text)
 
     # ======= DYNAMIC SUBSCRIBE CHO COIN MỚI (KHÔNG CẦN RESTART) =======
-    global WS_SUB_QUEUE, ALL_SYMBOLS
-
     for sym in new_coins:
-        if sym not in ALL_SYMBOLS:
-            ALL_SYMBOLS.append(sym)
+        ALL_SYMBOLS.add(sym)
 
-        if WS_SUB_QUEUE is not None:
+        if WS_LOOP is not None and not WS_LOOP.is_closed() and WS_SUB_QUEUES:
             try:
-                WS_SUB_QUEUE.put_nowait(sym)
+                WS_LOOP.call_soon_threadsafe(WS_SUB_QUEUES[shard_of(sym)].put_nowait, sym)
                 print(f"🧩 Queue subscribe coin mới: {sym}")
             except Exception as e:
                 print(f"⚠️ Không thể queue {sym} để subscribe: {e}")
 
 
-async def websocket_job(context: ContextTypes.DEFAULT_TYPE):
-    """Job wrapper để chạy websocket_stream sau khi Application đã chạy."""
-    app = context.application
-    await websocket_stream(app)
+async def supervised(name: str, factory) -> None:
+    """Chạy lại coroutine factory() mỗi khi nó thoát/lỗi - 1 task hỏng không kéo sập cả WS loop."""
+    while True:
+        try:
+            await factory()
+            print(f"⚠️ {name} dừng, chạy lại")
+        except Exception as e:
+            print(f"❌ {name} lỗi: {e}, chạy lại sau 1s")
+        await asyncio.sleep(1)
+
+
+async def ws_main(application: Application):
+    """Chạy WS_SHARDS websocket_stream + TICK_WORKERS tick_worker + reset base price trên WS loop."""
+    global TICK_QUEUE
+    TICK_QUEUE = FastQueue(maxlen=TICK_QUEUE_SIZE)
+    WS_SUB_QUEUES[:] = [asyncio.Queue() for _ in range(WS_SHARDS)]
+    await asyncio.gather(
+        *(supervised(f"tick_worker {i}", tick_worker) for i in range(TICK_WORKERS)),
+        supervised("reset_base_prices", reset_base_prices_loop),
+        *(
+            supervised(f"[WS {shard}]", lambda shard=shard: websocket_stream(application, shard))
+            for shard in range(WS_SHARDS)
+        ),
+    )
+
+
+def ws_thread(application: Application) -> None:
+    """Thread riêng cho WebSocket: recv/xử lý tick không tranh loop với Telegram, pickle, command."""
+    global WS_LOOP, WS_THREAD_ID
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    WS_THREAD_ID = threading.get_ident()
+    WS_LOOP = loop
+    # loop giữ mở suốt đời thread: job_new_listing vẫn call_soon_threadsafe vào được
+    while True:
+        try:
+            loop.run_until_complete(ws_main(application))
+        except Exception as e:
+            print(f"❌ WS thread lỗi: {e}, khởi động lại sau 5s")
+        time.sleep(5)
 
 
 # ================== APP SETUP ==================
@@ -1060,32 +1446,36 @@ async def post_init(application: Application):
     """Hàm chạy sau khi Application build xong nhưng trước khi polling."""
     # load dữ liệu persist
     load_data()
+    rebuild_sub_index()
 
     # preload ALL_SYMBOLS
+    global ALL_SYMBOLS, KNOWN_SYMBOLS, SEND_QUEUE, MAIN_LOOP
     try:
-        async with aiohttp.ClientSession() as session:
-            global ALL_SYMBOLS, KNOWN_SYMBOLS
-            ALL_SYMBOLS = await get_all_symbols(session)
-            if not KNOWN_SYMBOLS:
-                KNOWN_SYMBOLS = set(ALL_SYMBOLS)
+        ALL_SYMBOLS = set(await get_all_symbols(get_http_session()))
+        if not KNOWN_SYMBOLS:
+            KNOWN_SYMBOLS = set(ALL_SYMBOLS)
     except Exception as e:
         print(f"⚠️ Không preload được symbols: {e}")
 
-    # chạy WebSocket trong background bằng job_queue (tránh warning PTB)
+    # queue + worker gửi Telegram (rate limit 30 msg/s global, 1 msg/s mỗi chat)
+    SEND_QUEUE = asyncio.Queue(maxsize=SEND_QUEUE_MAXSIZE)
+    MAIN_LOOP = asyncio.get_running_loop()
     application.job_queue.run_once(
-        websocket_job,
-        when=2,
-        name="websocket_stream",
+        send_workers_job,
+        when=1,
+        name="send_workers",
     )
 
-    # job reset base price mỗi 5 phút
-    application.job_queue.run_repeating(
-        job_reset_base_prices,
-        interval=300,
-        first=300,
-        name="reset_base_prices",
+    # lưu dữ liệu theo kiểu debounce (không ghi file trong từng command)
+    application.job_queue.run_once(
+        save_worker_job,
+        when=1,
+        name="save_worker",
     )
 
+    # WebSocket + xử lý tick + reset base price 5 phút/lần trên thread riêng (event loop riêng)
+    threading.Thread(target=ws_thread, args=(application,), name="ws", daemon=True).start()
+
     # job check coin mới list mỗi 10 phút
     application.job_queue.run_repeating(
         job_new_listing,
@@ -1124,8 +1514,23 @@ async def post_init(application: Application):
     print("✅ post_init hoàn tất – bot sẵn sàng quét MEXC Futures realtime")
 
 
+async def post_shutdown(application: Application):
+    """Đóng các tài nguyên dùng chung khi bot dừng."""
+    if SAVE_DIRTY.is_set():
+        save_data()
+    await close_http_session()
+
+
 def main():
     from telegram.request import HTTPXRequest
+
+    # uvloop (libuv) nhanh hơn event loop mặc định; Windows không có thì bỏ qua
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        print("✅ Dùng uvloop event loop")
+    except ImportError:
+        pass
     
     # Tăng timeout để xử lý mạng chậm trên Railway
     request = HTTPXRequest(
@@ -1141,6 +1546,7 @@ def main():
         .request(request)
         .get_updates_request(request)
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
@@ -1159,7 +1565,19 @@ def main():
 
     print("🔥 Bot MEXC Futures Alert đang chạy…")
     try:
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if PUBLIC_URL:
+            # Webhook: Telegram đẩy update tới ngay, không phải chờ vòng getUpdates
+            print(f"🌐 Webhook mode: {PUBLIC_URL} (port {PORT})")
+            application.run_webhook(
+                listen="0.0.0.0",
+                port=PORT,
+                url_path=BOT_TOKEN,
+                webhook_url=f"{PUBLIC_URL}/{BOT_TOKEN}",
+                secret_token=WH_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
     except KeyboardInterrupt:
         print("⏸️ Bot dừng")
     except Exception as e: